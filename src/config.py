@@ -1,6 +1,7 @@
 import json
 import subprocess
 from enum import Enum
+from pathlib import Path
 from PySide6.QtWidgets import QFileDialog
 
 
@@ -12,15 +13,14 @@ class Status(Enum):
 
 def check_config_json():
     config = {}
-    flag_configChanged = 0
     with open('config.json', 'r', encoding = 'utf-8') as fp:
         config.update(json.load(fp))
+    original = dict(config)
     
-    while not check_mkvextractor(config['mkvtoolnix']):
+    while not check_mkvextractor(config):
         config['mkvtoolnix'] = ask_for_mkvtoolnix()
-        flag_configChanged += 1
     
-    if flag_configChanged:
+    if config != original:
         with open('config.json', 'w', encoding = 'utf-8') as fp:
             json.dump(config, fp, indent = 4, ensure_ascii = False)
 
@@ -28,11 +28,27 @@ def ask_for_mkvtoolnix():
     folder = QFileDialog.getExistingDirectory(caption = '选择mkvtoolnix文件夹路径')
     return folder
 
-def check_mkvextractor(path) -> bool:
+def check_mkvextractor(config: dict) -> bool:
+    '''Validate the mkvtoolnix path in config.
+
+    The binary and its version are cached in config, mkvextract is spawned
+    again only when the binary has been replaced since the last check.
+    '''
+    for name in ('mkvextract.exe', 'mkvextract'):
+        if (binary := Path(config['mkvtoolnix']) / name).is_file():
+            break
+    else:
+        return False
+
+    mtime = binary.stat().st_mtime_ns
+    cache = config.get('mkvtoolnix_cache', {})
+    if cache.get('binary') == str(binary) and cache.get('mtime') == mtime:
+        return True
     try:
-        subprocess.run([f'{path}\\mkvextract', '--version'])
-    except FileNotFoundError:
+        result = subprocess.run([binary, '--version'], capture_output = True, text = True)
+    except OSError:
         return False
+    config['mkvtoolnix_cache'] = {'binary': str(binary), 'mtime': mtime, 'version': result.stdout.strip()}
     return True
 
 def read_config():
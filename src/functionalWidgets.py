@@ -2,9 +2,11 @@ import io
 from contextlib import redirect_stdout
 
 from config import Status
-from mkvextractor import MkvSubExtractor
 from subtitle import Subtitle
 from textprocessor import TextProcessor, BilingualText
+from translationmemory import open_memory
+from tracing import span
+from resultcache import result_cache
 
 from PySide6.QtCore import Qt, QTimer
 from PySide6.QtWidgets import (
@@ -25,6 +27,8 @@ class MkvListWidget(QListWidget):
         # Called when track row is selected
         self.currentRowChanged.connect(self.select_row)
         
+        # Imported only when an MKV is loaded
+        from mkvextractor import MkvSubExtractor
         self.mkv = MkvSubExtractor(self.mainWindow.path)
         self.show_sub_tracks()
         
@@ -94,16 +98,34 @@ class SubtitleDisplay(QWidget):
         self.setLayout(layout)
         
     def read_sub(self):
-        self.subtitle = Subtitle(self.mainWindow.path)
-        if self.subtitle.path.suffix == '.ass':
+        path = self.mainWindow.path
+        # Styles of ASS have to be picked first, other subtitles are parsed only on a cache miss
+        self.subtitle = None
+        styles = []
+        if path.suffix == '.ass':
+            self.subtitle = Subtitle(path)
             self.pick_styles()
+            styles = self.subtitle.styles
 
         # For monolingual subtitle, text are waiting to be preprocessed
         if self.mainWindow.status == Status.MONOLINGUAL:
             self.mainWindow.extractButton.setText('提取字幕')
+            cache = result_cache()
+            key = cache.key(path, styles, '.txt')
+            # Nothing is picked when the dialog of styles is cancelled, which is never cached
+            cacheable = self.subtitle is None or self.subtitle.picked
+            if (textprocessor := cache.get(key) if cacheable else None) is None:
+                if self.subtitle is None:
+                    self.subtitle = Subtitle(path)
+                textprocessor = TextProcessor(self.subtitle.extractText())
+                if cacheable:
+                    cache.put(key, textprocessor)
+            self.textprocessor = textprocessor
             # Show raw text and processed text
-            self.leftDisplay.setPlainText(self.subtitle.raw_contents)
-            self.textprocessor = TextProcessor(self.subtitle.extractText())
+            if self.subtitle is not None:
+                self.leftDisplay.setPlainText(self.subtitle.raw_contents)
+            else:
+                self.leftDisplay.setPlainText(path.read_text(encoding = 'utf-8-sig'))
             self.rightDisplay.setPlainText(self.textprocessor.text)
             
             # Can only be extracted into .txt file
@@ -132,36 +154,63 @@ class BilingualTable(QTableWidget):
         self.show_text()
     
     def load_text(self):
-        self.bilingualText = BilingualText()
+        path = self.mainWindow.path
         self.mainWindow.outputFortmat.clear()
-        match self.mainWindow.path.suffix:
+        match path.suffix:
             case '.ass':
-                self.bilingualText.load_from_ass(self.mainWindow.subtitleDisplay.subtitle)
+                styles = self.mainWindow.subtitleDisplay.subtitle.styles
                 outputFomrmats = ['.xlsx', '.txt']
             case '.txt':
-                self.bilingualText.load_from_file(self.mainWindow.path)
+                styles = []
                 outputFomrmats = ['.xlsx']
             case '.xlsx':
-                self.bilingualText.load_from_file(self.mainWindow.path)
+                styles = []
                 outputFomrmats = ['.txt']
+
+        # The loaded text is the same whichever format it is written into
+        cache = result_cache()
+        key = cache.key(path, styles, 'bilingual')
+        if (bilingualText := cache.get(key)) is None:
+            bilingualText = BilingualText()
+            if path.suffix == '.ass':
+                bilingualText.load_from_ass(self.mainWindow.subtitleDisplay.subtitle)
+            else:
+                bilingualText.load_from_file(path)
+            cache.put(key, bilingualText)
+        self.bilingualText = bilingualText
         self.mainWindow.outputFortmat.addItems(outputFomrmats)
         
     def show_text(self):
+        # A third column for suggestions when a translation memory is set
+        memory = open_memory()
         rows = len(self.bilingualText)
-        columns = 2
+        columns = 2 if memory is None else 3
         self.setRowCount(rows)
         self.setColumnCount(columns)
+        self.setHorizontalHeaderLabels(['日文', '中文', '记忆库译文'][:columns])
         self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Preferred)
         self.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
         
         for row in range(rows):
-            for column in range(columns):
+            for column in range(2):
                 item = QTableWidgetItem(self.bilingualText[row][column])
                 self.setItem(row, column, item)
+
+        if memory is not None:
+            # Renderings from other episodes only, not this one itself
+            episode = self.mainWindow.path.stem
+            with memory, span('TranslationMemory.suggest'):
+                for row in range(rows):
+                    suggestion = memory.suggest(self.bilingualText[row][0], exclude = episode)
+                    self.setItem(row, 2, QTableWidgetItem(suggestion))
     
     def extract(self):
         path = self.mainWindow.constructOutputPath()
         self.bilingualText.write(path)
+        # Keep the pairs of this episode for later ones
+        if (memory := open_memory()) is not None:
+            with memory:
+                memory.ingest(self.bilingualText, self.mainWindow.path.stem)
         QMessageBox.information(self.mainWindow, '提示', '完成')
 
 
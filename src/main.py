@@ -1,14 +1,55 @@
 import sys
+import time
+# Taken before anything else is imported, as the origin of time-to-first-window
+START = time.perf_counter()
+
+import os
+import argparse
 from mainWindow import MainWindow
+from PySide6.QtCore import QTimer
 from PySide6.QtWidgets import QApplication
 from config import check_config_json
+from tracing import tracer, format_summary
+from resultcache import result_cache
+
+def parse_args():
+    parser = argparse.ArgumentParser(description = 'KitaujiSub')
+    parser.add_argument('--startup-benchmark', action = 'store_true',
+                        help = '显示窗口后输出启动耗时并退出')
+    parser.add_argument('--trace', action = 'store_true',
+                        help = '记录各处理阶段耗时，亦可设置环境变量KITAUJI_TRACE=1')
+    parser.add_argument('--trace-memory', action = 'store_true',
+                        help = '同时用tracemalloc记录各阶段内存峰值，亦可设置环境变量KITAUJI_TRACE_MEMORY=1')
+    parser.add_argument('--trace-output', default = os.environ.get('KITAUJI_TRACE_OUTPUT'),
+                        help = '退出时将记录写为Chrome trace-event JSON文件')
+    parser.add_argument('--no-cache', action = 'store_true',
+                        help = '不使用也不写入结果缓存')
+    # The rest are left for Qt
+    return parser.parse_known_args()
 
 def main():
-    app = QApplication(sys.argv)
+    args, qtArgs = parse_args()
+    if args.trace or args.trace_memory:
+        tracer.configure(True, args.trace_memory or tracer.memory)
+    if args.no_cache:
+        result_cache().enabled = False
+    app = QApplication(sys.argv[:1] + qtArgs)
     check_config_json()
     window = MainWindow()
     window.show()
-    sys.exit(app.exec())
+    if args.startup_benchmark:
+        # Fired once the event loop has shown the window
+        def report():
+            print(f'first window: {(time.perf_counter() - START) * 1000:.1f} ms', flush = True)
+            app.quit()
+        QTimer.singleShot(0, report)
+    code = app.exec()
+    if tracer.enabled:
+        print(format_summary(tracer.summary()), file = sys.stderr)
+        print(result_cache().stats(), file = sys.stderr)
+        if args.trace_output:
+            tracer.export(args.trace_output)
+    sys.exit(code)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,5 +1,7 @@
 from pathlib import Path
 from config import Status
+from tracing import tracer, format_summary
+from resultcache import result_cache
 from functionalWidgets import (
     MkvListWidget, SubtitleDisplay, BilingualTable, InputFileLineEdit
 )
@@ -114,6 +116,7 @@ class MainWindow(QWidget):
             return
 
         self.format = self.path.suffix
+        mark = tracer.mark()
         match self.format:
             case '.mkv':
                 self.create_mkvLoader()
@@ -123,6 +126,10 @@ class MainWindow(QWidget):
                 self.read_bilingual_text()
             case _:
                 QMessageBox.warning(self, 'Warning', '不受支持的格式')
+        # Timing breakdown of the stages run by this load
+        if tracer.enabled:
+            stages = format_summary(tracer.summary(mark), '  |  ')
+            self.tipLabel.setText('    ' + '  |  '.join(filter(None, [stages, result_cache().stats()])))
         
         # Set a default output filename
         self.outputFileDir.setText(str(self.path.parent))
@@ -2,6 +2,7 @@ import subprocess
 import json
 from pathlib import Path
 from config import read_config
+from tracing import traced
 
 
 class MkvSubExtractor:
@@ -13,6 +14,7 @@ class MkvSubExtractor:
         self.path = Path(path)
         self.read_sub_tracks()
 
+    @traced('MkvSubExtractor.read_sub_tracks')
     def read_sub_tracks(self):
         result = subprocess.run(
             [self.merge, self.path, '-i', '-F', 'json'],
@@ -27,6 +29,7 @@ class MkvSubExtractor:
     def get_track_id(self, track: int):
         return self.subTracks[track]['id']
 
+    @traced('MkvSubExtractor.extract_subtitle')
     def extract_subtitle(self, track_id, outputPath: Path):
         subprocess.run([self.extract, self.path, 'tracks', f"{track_id}:{str(outputPath)}"])
 
@@ -0,0 +1,157 @@
+import re
+import zlib
+import random
+import unicodedata
+from enum import Enum
+from typing import NamedTuple
+from collections import defaultdict
+from collections.abc import Sequence
+
+from timeline import Timeline
+
+
+class MergeStrategy(Enum):
+    # Text and timing of the longest cue in a cluster
+    KEEP_LONGEST = 0
+    # Text of the longest cue, timing spanning the whole cluster
+    UNION_SPAN = 1
+
+
+class ClusterStats(NamedTuple):
+    size: int
+    # Time span of the cluster in millisecond
+    start: int
+    end: int
+    # The lowest similarity among the pairs joined into this cluster
+    similarity: float
+    text: str
+
+
+class NearDuplicateIndex:
+    '''Cluster cues overlapping in time whose texts are nearly the same, e.g. rolling captions.
+
+    Texts are normalized and cut into character shingles. MinHash signatures of the
+    shingles are banded into an LSH index, so only cues sharing a bucket are compared.
+    Candidates are then verified by containment, the share of the shorter text's shingles
+    found in the longer one, which stays high when a caption grows word by word.
+    '''
+    distractions = re.compile(r'\u200e|&lrm;|&nbsp;|<.*?>|\{.*?\}|\\[Nnh]')
+
+    def __init__(self, lines: Sequence[Timeline], threshold: float = 0.8, gap: int = 0,
+                 shingle: int = 2, bands: int = 16, rows: int = 2, seed: int = 0) -> None:
+        self.lines = list(lines)
+        self.threshold = threshold
+        # Cues separated by no more than gap milliseconds count as overlapping
+        self.gap = gap
+        self.shingle = shingle
+        self.bands = bands
+        self.rows = rows
+        # XOR with a random mask permutes the 32-bit hash space, which is much cheaper
+        # in Python than universal hashing and good enough for short captions
+        generator = random.Random(seed)
+        self.masks = [generator.getrandbits(32) for _ in range(bands * rows)]
+        self.starts = [line.start.time for line in self.lines]
+        self.ends = [line.end.time for line in self.lines]
+
+        self.shingles = [self.shingles_of(line.text) for line in self.lines]
+        self.buckets: dict[tuple, list[int]] = defaultdict(list)
+        for idx, shingles in enumerate(self.shingles):
+            if shingles:
+                self.index(idx, self.signature(shingles))
+        self.cluster()
+
+    @classmethod
+    def normalize(cls, text: str) -> str:
+        text = cls.distractions.sub('', text)
+        text = unicodedata.normalize('NFKC', text).lower()
+        # Punctuation and spaces are ignored
+        return re.sub(r'\W', '', text)
+
+    def shingles_of(self, text: str) -> frozenset[int]:
+        text = NearDuplicateIndex.normalize(text)
+        if len(text) <= self.shingle:
+            grams = [text] if text else []
+        else:
+            grams = [text[i:i+self.shingle] for i in range(len(text) - self.shingle + 1)]
+        return frozenset(zlib.crc32(gram.encode('utf-8')) for gram in grams)
+
+    def signature(self, shingles: frozenset[int]) -> list[int]:
+        return [min([x ^ mask for x in shingles]) for mask in self.masks]
+
+    def index(self, idx: int, signature: list[int]) -> None:
+        for band in range(self.bands):
+            rows = tuple(signature[band*self.rows:(band+1)*self.rows])
+            self.buckets[(band, rows)].append(idx)
+
+    def similarity(self, i: int, j: int) -> float:
+        '''Containment of the shorter text in the longer one'''
+        a, b = self.shingles[i], self.shingles[j]
+        return len(a & b) / min(len(a), len(b))
+
+    def candidates(self):
+        '''Pairs sharing an LSH bucket and overlapping in time'''
+        seen = set()
+        for members in self.buckets.values():
+            if len(members) < 2:
+                continue
+            members = sorted(members, key = self.starts.__getitem__)
+            # Sorted by start, the scan of each cue stops at the first one starting after it ends
+            for n, i in enumerate(members):
+                end = self.ends[i] + self.gap
+                for k in range(n + 1, len(members)):
+                    if self.starts[j := members[k]] > end:
+                        break
+                    if (i, j) not in seen:
+                        seen.add((i, j))
+                        yield i, j
+
+    def cluster(self) -> None:
+        parent = list(range(len(self.lines)))
+        def find(idx):
+            while parent[idx] != idx:
+                parent[idx] = parent[parent[idx]]
+                idx = parent[idx]
+            return idx
+
+        self.weakest: dict[int, float] = {}
+        for i, j in self.candidates():
+            if (score := self.similarity(i, j)) < self.threshold:
+                continue
+            if (ri := find(i)) == (rj := find(j)):
+                continue
+            # The weakest link of the union is the lowest of both clusters and the joining pair
+            self.weakest[ri] = min(score, self.weakest.get(ri, 1.0), self.weakest.pop(rj, 1.0))
+            parent[rj] = ri
+
+        groups = defaultdict(list)
+        for idx in range(len(self.lines)):
+            groups[find(idx)].append(idx)
+        self.clusters = sorted(groups.values(), key = lambda group: min(self.starts[idx] for idx in group))
+        self.similarities = [self.weakest.get(find(group[0]), 1.0) for group in self.clusters]
+
+    def longest(self, group: list[int]) -> Timeline:
+        # The latest one wins a tie, as rolling captions only grow
+        return max((self.lines[idx] for idx in group),
+                   key = lambda line: (len(NearDuplicateIndex.normalize(line.text)), line.start))
+
+    def merge(self, strategy: MergeStrategy = MergeStrategy.UNION_SPAN) -> list[Timeline]:
+        merged = []
+        for group in self.clusters:
+            kept = self.longest(group)
+            if strategy == MergeStrategy.UNION_SPAN and len(group) > 1:
+                start = min(self.starts[idx] for idx in group)
+                end = max(self.ends[idx] for idx in group)
+                kept = Timeline.from_ms(start, end, kept.text)
+            merged.append(kept)
+        return merged
+
+    def stats(self) -> list[ClusterStats]:
+        '''Stats of the clusters with more than one cue'''
+        stats = []
+        for group, similarity in zip(self.clusters, self.similarities):
+            if len(group) < 2:
+                continue
+            start = min(self.starts[idx] for idx in group)
+            end = max(self.ends[idx] for idx in group)
+            stats.append(ClusterStats(len(group), start, end, similarity, self.longest(group).text))
+        return stats
@@ -0,0 +1,127 @@
+import os
+import pickle
+import hashlib
+import functools
+from pathlib import Path
+from collections.abc import Sequence
+
+
+class ResultCache:
+    '''Results of the file -> output pipeline on disk, keyed by what they are derived from.
+
+    A key covers the content of the input file, the picked styles, the content of
+    patterns.csv and the kind of output, so editing anything else never invalidates
+    an entry. Entries are evicted least recently used first once the directory
+    grows beyond maxSize bytes.
+    '''
+    # Bumped whenever the pickled classes change, so that old entries are never loaded
+    schemaVersion = 1
+
+    def __init__(self, directory: Path, maxSize: int) -> None:
+        self.directory = Path(directory)
+        self.maxSize = maxSize
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(path: Path) -> str:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as fp:
+            while chunk := fp.read(1 << 20):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def key(self, path: Path, styles: Sequence[str], fmt: str) -> str:
+        sha = hashlib.sha256()
+        sha.update(f'{self.schemaVersion}\0'.encode())
+        sha.update(self.digest(path).encode())
+        # Order of styles matters, cues of the same start are kept in picked order
+        sha.update('\0'.join(styles).encode('utf-8'))
+        patterns = Path('patterns.csv')
+        sha.update(self.digest(patterns).encode() if patterns.exists() else b'')
+        sha.update(fmt.encode('utf-8'))
+        return sha.hexdigest()
+
+    def get(self, key: str):
+        '''The cached result, or None on a miss'''
+        if not self.enabled:
+            return None
+        entry = self.directory / f'{key}.pickle'
+        try:
+            with open(entry, 'rb') as fp:
+                value = pickle.load(fp)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception:
+            # Unpickling a truncated or outdated entry may raise almost anything, drop it
+            try:
+                os.remove(entry)
+            except OSError:
+                pass
+            self.misses += 1
+            return None
+        # Touched on every hit, the mtime orders entries for eviction. Another worker may have
+        # evicted it since, which leaves the loaded value as good as ever
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value) -> None:
+        if not self.enabled:
+            return
+        self.directory.mkdir(parents = True, exist_ok = True)
+        entry = self.directory / f'{key}.pickle'
+        # Written aside and renamed, as workers of a batch run may write at the same time
+        temporary = entry.with_suffix(f'.{os.getpid()}.tmp')
+        with open(temporary, 'wb') as fp:
+            pickle.dump(value, fp, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, entry)
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pickle'):
+                # Entries removed meanwhile by another worker are skipped
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.maxSize:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def count(self, hit: bool) -> None:
+        '''Tally a lookup made in another process'''
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def stats(self) -> str:
+        state = '' if self.enabled else ' (disabled)'
+        return f'result cache: {self.hits} hits, {self.misses} misses{state}'
+
+
+@functools.cache
+def result_cache() -> ResultCache:
+    '''The cache shared by the process, set by cache_dir and cache_size_mb in config.json'''
+    from config import read_config
+    try:
+        config = read_config()
+    except FileNotFoundError:
+        config = {}
+    return ResultCache(Path(config.get('cache_dir', 'cache')),
+                       int(config.get('cache_size_mb', 256)) << 20)
@@ -0,0 +1,57 @@
+import re
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+from collections import defaultdict
+
+MAIN = Path(__file__).with_name('main.py')
+
+
+def run_once() -> tuple[float, float, dict[str, int]]:
+    '''Start the GUI once under -X importtime, return wall time, time-to-first-window and import self times'''
+    begin = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', str(MAIN), '--startup-benchmark'],
+        capture_output = True, text = True, encoding = 'utf-8'
+    )
+    wall = (time.perf_counter() - begin) * 1000
+    if (found := re.search(r'first window: ([\d.]+) ms', result.stdout)) is None:
+        raise RuntimeError(f'The window was not shown:\n{result.stderr[-2000:]}')
+
+    # Lines as "import time: self [us] | cumulative | imported package",
+    # nested imports are indented under the package name
+    imports = {}
+    for line in result.stderr.splitlines():
+        if (match := re.match(r'import time:\s+(\d+) \|\s+\d+ \| (.+)$', line)):
+            imports[match.group(2).strip()] = int(match.group(1))
+    return wall, float(found.group(1)), imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description = '测量程序冷启动耗时，需在config.json所在目录运行')
+    parser.add_argument('-n', '--runs', type = int, default = 5)
+    parser.add_argument('--top', type = int, default = 10, help = '列出自身导入耗时最多的模块数量')
+    args = parser.parse_args()
+
+    walls, windows = [], []
+    imports = defaultdict(list)
+    for _ in range(args.runs):
+        wall, window, timings = run_once()
+        walls.append(wall)
+        windows.append(window)
+        for module, selfTime in timings.items():
+            imports[module].append(selfTime)
+
+    print(f'process wall time:    median {statistics.median(walls):8.1f} ms, min {min(walls):8.1f} ms')
+    print(f'time to first window: median {statistics.median(windows):8.1f} ms, min {min(windows):8.1f} ms')
+    print('slowest imports (median self time):')
+    medians = sorted(((statistics.median(times) / 1000, module) for module, times in imports.items()), reverse = True)
+    for ms, module in medians[:args.top]:
+        print(f'    {ms:8.1f} ms  {module}')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,13 +3,67 @@ from abc import abstractmethod
 from typing import Iterator
 
 import re
+import mmap
 import itertools
 import functools
 import operator
+from array import array
 from pathlib import Path
 from collections import Counter
 
-from timeline import Timeline
+from timeline import Timeline, Time
+from tracing import span, traced
+from nearduplicate import NearDuplicateIndex, MergeStrategy, ClusterStats
+
+
+@functools.cache
+def _numpy():
+    '''NumPy is optional and imported on the first bulk retiming, array columns are used without it'''
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+class CueTrack:
+    '''Every cue of a subtitle as parallel columns, with times as integers in millisecond.
+
+    Bulk retiming transforms the two time columns in one pass, Timeline objects are
+    built from them again only when the cues are read. For ASS, the other fields of
+    each event are kept as they are, so that writing it back changes only the times.
+    '''
+    def __init__(self, starts: list[int], ends: list[int], texts: list[str], styles: list[str],
+                 heads: list[str] | None = None, middles: list[str] | None = None) -> None:
+        # Turned into NumPy arrays by the first bulk retiming, so that loading never imports it
+        self.starts, self.ends = array('q', starts), array('q', ends)
+        self.texts = texts
+        self.styles = styles
+        # Fields of ASS events before Start, e.g. 'Dialogue: 0', and from Name to Effect, e.g. ',0,0,0,'
+        self.heads = heads
+        self.middles = middles
+
+    @classmethod
+    def from_lines(cls, lines: list[Timeline]) -> 'CueTrack':
+        return cls([line.start.time for line in lines], [line.end.time for line in lines],
+                   [line.text for line in lines], ['Default'] * len(lines))
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def shown(self, row: int) -> bool:
+        # Comment events of ASS are never displayed
+        return self.heads is None or self.heads[row].startswith('Dialogue')
+
+    def groups(self) -> list[int]:
+        '''A number per style for cues trimmed against each other, -1 for those never trimmed'''
+        codes = {}
+        return [codes.setdefault(style, len(codes)) if self.shown(row) else -1
+                for row, style in enumerate(self.styles)]
+
+    def timelines(self) -> list[Timeline]:
+        return [Timeline.from_ms(start, end, text)
+                for start, end, text in zip(self.starts.tolist(), self.ends.tolist(), self.texts)]
 
 
 class Subtitle(MutableSequence):
@@ -23,12 +77,48 @@ class Subtitle(MutableSequence):
 
     def __init__(self, path: Path):
         self.path = path
-        self.contents: list[Timeline] = []
+        self._track: CueTrack | None = None
+        self.contents = []
         self.bilingual = False
+        self._raw_contents = None
         
-        with open(path, 'r', encoding = 'utf-8') as fp:
-            self.raw_contents = fp.read()
-        self.parse()
+        with span(f'{type(self).__name__}.parse'):
+            self.parse()
+        # Parsed results are kept in self.contents, the text is read again only when displayed
+        self._raw_contents = None
+
+    @property
+    def raw_contents(self) -> str:
+        '''The whole text of the file, read lazily'''
+        if self._raw_contents is None:
+            with open(self.path, 'r', encoding = 'utf-8-sig') as fp:
+                self._raw_contents = fp.read()
+        return self._raw_contents
+
+    @property
+    def contents(self) -> list[Timeline]:
+        # Dropped by a bulk retiming and rebuilt from the track when next read
+        if self._contents is None:
+            self.materialize()
+        return self._contents
+
+    @contents.setter
+    def contents(self, lines: list[Timeline]) -> None:
+        self._contents = lines
+        self._edited()
+
+    @property
+    def track(self) -> CueTrack:
+        if self._track is None:
+            self._track = CueTrack.from_lines(self.contents)
+        return self._track
+
+    def materialize(self) -> None:
+        self._contents = self.track.timelines()
+
+    def _edited(self) -> None:
+        # The track is taken from the cues again at the next bulk retiming
+        self._track = None
 
     # These five are the abstract methods in MutableSequence
     def __getitem__(self, key: int) -> Timeline:
@@ -36,9 +126,11 @@ class Subtitle(MutableSequence):
 
     def __setitem__(self, key: int, value: Timeline) -> None:
         self.contents[key] = value
+        self._edited()
 
     def __delitem__(self, key: Timeline) -> None:
         del self.contents[key]
+        self._edited()
 
     def __iter__(self) -> Iterator[Timeline]:
         return iter(self.contents)
@@ -47,7 +139,8 @@ class Subtitle(MutableSequence):
         return len(self.contents)
 
     def insert(self, index: int, value: Timeline) -> None:
-        return self.contents.insert(index, value)
+        self.contents.insert(index, value)
+        self._edited()
 
     def sort(self, key = lambda x: x.start):
         self.contents.sort(key = key)
@@ -62,6 +155,146 @@ class Subtitle(MutableSequence):
             raise TypeError('Only for monolingual subtitle')
         return '\n'.join(line.text for line in self)
 
+    def rows(self) -> list[int]:
+        '''Rows of the track written as SRT or VTT'''
+        return list(range(len(self.track)))
+
+    def _retime(self, operation) -> None:
+        # Only the two integer columns are transformed, Timeline objects are rebuilt when read
+        track = self.track
+        if len(track):
+            if (np := _numpy()) is not None:
+                track.starts, track.ends = np.asarray(track.starts), np.asarray(track.ends)
+            track.starts, track.ends = operation(track.starts, track.ends)
+        self._retimed()
+
+    def _retimed(self) -> None:
+        self._contents = None
+
+    def shift(self, offset: int) -> None:
+        '''Move every cue by offset milliseconds, cues are never moved before zero'''
+        np = _numpy()
+        def operation(starts, ends):
+            if np is not None:
+                return np.maximum(starts + offset, 0), np.maximum(ends + offset, 0)
+            return (array('q', [max(t + offset, 0) for t in starts]),
+                    array('q', [max(t + offset, 0) for t in ends]))
+        self._retime(operation)
+
+    def scale(self, factor: float) -> None:
+        '''Multiply every timestamp by factor'''
+        np = _numpy()
+        def operation(starts, ends):
+            if np is not None:
+                return (np.rint(starts * factor).astype(np.int64),
+                        np.rint(ends * factor).astype(np.int64))
+            return (array('q', [round(t * factor) for t in starts]),
+                    array('q', [round(t * factor) for t in ends]))
+        self._retime(operation)
+
+    def convert_fps(self, source: float, target: float) -> None:
+        '''Retime for a video sped up or slowed down from source to target fps, e.g. 23.976 to 25'''
+        self.scale(source / target)
+
+    def clamp(self, lower: int = 0, upper: int | None = None) -> None:
+        '''Limit every timestamp into [lower, upper] in millisecond'''
+        np = _numpy()
+        def operation(starts, ends):
+            if np is not None:
+                return np.clip(starts, lower, upper), np.clip(ends, lower, upper)
+            top = upper if upper is not None else max(ends)
+            return (array('q', [min(max(t, lower), top) for t in starts]),
+                    array('q', [min(max(t, lower), top) for t in ends]))
+        self._retime(operation)
+
+    def drop_overlaps(self) -> None:
+        '''Trim each cue so that it ends no later than the next one of the same style starts.
+
+        Cues sharing the same start, e.g. several speakers at once, are not trimmed against
+        each other, but all of them against the next later start.
+        '''
+        np = _numpy()
+        groups = self.track.groups()
+        def operation(starts, ends):
+            if np is not None:
+                codes = np.array(groups, dtype = np.int64)
+                # Sorted by style, then by start time
+                order = np.lexsort((starts, codes))
+                sortedStarts, sortedEnds, codes = starts[order], ends[order], codes[order]
+                size = len(order)
+                # Runs of cues sharing both style and start, each cue looks at the first one after its run
+                first = np.ones(size, dtype = bool)
+                first[1:] = (codes[1:] != codes[:-1]) | (sortedStarts[1:] != sortedStarts[:-1])
+                following = np.append(np.flatnonzero(first)[1:], size)[np.cumsum(first) - 1]
+                valid = following < size
+                following = np.minimum(following, size - 1)
+                trim = valid & (codes[following] == codes) & (codes >= 0)
+                trimmed = ends.copy()
+                trimmed[order] = np.where(trim, np.minimum(sortedEnds, sortedStarts[following]), sortedEnds)
+                return starts, trimmed
+            order = sorted(range(len(starts)), key = lambda row: (groups[row], starts[row]))
+            trimmed = array('q', ends)
+            # Walked backwards, keeping the nearest start later than the current one in the style
+            group = later = last = None
+            for row in reversed(order):
+                if groups[row] != group:
+                    group, later = groups[row], None
+                elif starts[row] != last:
+                    later = last
+                last = starts[row]
+                if group >= 0 and later is not None:
+                    trimmed[row] = min(ends[row], later)
+            return starts, trimmed
+        self._retime(operation)
+
+    @traced('Subtitle.write')
+    def write(self, path: Path) -> None:
+        '''Write the cues as SRT, VTT or ASS according to the suffix of path'''
+        match path.suffix:
+            case '.srt': text = self._formatSRT()
+            case '.vtt': text = self._formatVTT()
+            case '.ass': text = self._formatASS()
+            case _: raise ValueError('Unsupported format.')
+        # The whole output is assembled in memory and written at once
+        with open(path, 'w', encoding = 'utf-8') as fp:
+            fp.write(text)
+
+    def _formatSRT(self) -> str:
+        srt = Time.srt
+        return ''.join(f'{idx}\n{srt(start)} --> {srt(end)}\n{text}\n\n'
+                       for idx, (start, end, text) in enumerate(self._cues('\\N', '\n'), start = 1))
+
+    def _formatVTT(self) -> str:
+        vtt = Time.vtt
+        return 'WEBVTT\n\n' + ''.join(f'{vtt(start)} --> {vtt(end)}\n{text}\n\n'
+                                       for start, end, text in self._cues('\\N', '\n'))
+
+    def _formatASS(self) -> str:
+        ass = Time.ass
+        events = ''.join(f'Dialogue: 0,{ass(start)},{ass(end)},Default,,0,0,0,,{text}\n'
+                         for start, end, text in self._cues('\n', '\\N'))
+        return f'{ASS_DEFAULT_HEADER}\n\n[Events]\n{ASS_EVENTS_FORMAT}\n{events}'
+
+    def _cues(self, linebreak: str, replacement: str):
+        '''Start, end and text of the rows to write, sorted by start time'''
+        track = self.track
+        starts, ends = track.starts.tolist(), track.ends.tolist()
+        # Line breaks are written as \N in ASS but as real ones in SRT and VTT
+        for row in sorted(self.rows(), key = starts.__getitem__):
+            yield starts[row], ends[row], track.texts[row].replace(linebreak, replacement)
+
+
+ASS_DEFAULT_HEADER = '''[Script Info]
+ScriptType: v4.00+
+PlayResX: 1920
+PlayResY: 1080
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Default,Arial,60,&H00FFFFFF,&H000000FF,&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,2,2,2,10,10,10,1'''
+
+ASS_EVENTS_FORMAT = 'Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text'
+
 
 class ASSReader(Subtitle):
     timestamp = re.compile(r'.+?: \d,(\d:\d{2}:\d{2}[.]\d{2}),(\d:\d{2}:\d{2}[.]\d{2}),(.+?),,\d+,\d+,\d+,,(.+?)$')
@@ -69,47 +302,180 @@ class ASSReader(Subtitle):
         super().__init__(path)
 
     def parse(self) -> None:
-        # For ASS files, search for V4+ Styles part and Events part
-        for part in  self.raw_contents.split('\n\n'):
-            match part.split('\n')[0]:
-                case '[V4+ Styles]':
-                    self.stylelist = part
-                case '[Events]':
-                    self.events = part
-                case _:
-                    pass
+        # For ASS files, only Script Info, V4+ Styles and Events parts are decoded
+        self.sections = ASSSectionScanner(self.path)
+        self.scriptInfo = self.sections.read('[Script Info]')
+        self.stylelist = self.sections.read('[V4+ Styles]')
         # Get all the existing styles. Waiting for a pick() method to dump them into self.contents.
         self.styles = re.findall(r'Style: (.+?),', self.stylelist)
+        self.picked = False
+        # Sections copied into written files, kept once read as the source may be overwritten
+        self.copies: dict[str, str] = {}
 
+        # Every event, including comments and those of styles never picked, is kept for writing
+        lines = self.sections.read('[Events]').split('\n')
+        self.eventFormat = lines[1] if len(lines) > 1 else ASS_EVENTS_FORMAT
+        starts, ends, texts, styles, heads, middles = [], [], [], [], [], []
+        for line in lines[2:]:
+            # if results := re.search(self.timestamp, line):
+            #     start, end, style, text = results.groups()
+            try:
+                head, start, end, style, *middle, text = line.split(',', maxsplit = 9)
+                start, end = Time.parse(start), Time.parse(end)
+            except ValueError:
+                continue
+            starts.append(start)
+            ends.append(end)
+            texts.append(text)
+            styles.append(style)
+            heads.append(head)
+            middles.append(','.join(middle))
+        self._track = CueTrack(starts, ends, texts, styles, heads, middles)
+
+    def __getattr__(self, name: str):
+        # Lists of the picked styles are dropped by a bulk retiming and rebuilt when next read
+        if self.__dict__.get('picked') and name in self.__dict__.get('styles', ()):
+            self.materialize()
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+    @traced('ASSReader.pick')
     def pick(self, styles: str) -> None:
         self.styles = styles
+        self.picked = True
         cn = 0
         jp = 0
-        # Construct a dictionary for each picked style
         for style in self.styles:
-            self.__dict__[style] = []
             if 'jp' in style.lower():
                 jp += 1
             elif 'cn' in style.lower():
                 cn += 1
         self.bilingual = bool(cn * jp)
-        
-        lines = self.events.split('\n')[2:]
-        for line in lines:
-            # if results := re.search(self.timestamp, line):
-            #     start, end, style, text = results.groups()
-            try:
-                _, start, end, style, *_, text = line.split(',', maxsplit = 9)
-                # Write the text, along with the timeline, into the dictionary specified by style
-                if (stylelist := self.__dict__.get(style)) is not None:
-                    line = Timeline(start, end, text)
-                    stylelist.append(line)
-            except ValueError:
-                pass
+        self.materialize()
 
-        if not self.bilingual:
+    def materialize(self) -> None:
+        if not self.picked:
+            self._contents = []
+            return
+        # Construct a list for each picked style
+        stylelists = {style: [] for style in self.styles}
+        track = self.track
+        for start, end, style, text in zip(track.starts.tolist(), track.ends.tolist(), track.styles, track.texts):
+            # Write the text, along with the timeline, into the list specified by style
+            if (stylelist := stylelists.get(style)) is not None:
+                stylelist.append(Timeline.from_ms(start, end, text))
+        self.__dict__.update(stylelists)
+        self._contents = [] if self.bilingual else [line for style in self.styles for line in stylelists[style]]
+
+    def _edited(self) -> None:
+        # The track holds every event of the file and is never rebuilt from the picked cues
+        pass
+
+    def _retimed(self) -> None:
+        super()._retimed()
+        if self.picked:
             for style in self.styles:
-                self.extend(getattr(self, style))
+                self.__dict__.pop(style, None)
+
+    def rows(self) -> list[int]:
+        # The picked styles only once picked, every style before
+        track = self.track
+        styles = set(self.styles) if self.picked else None
+        return [row for row, style in enumerate(track.styles)
+                if track.shown(row) and (styles is None or style in styles)]
+
+    def _formatASS(self) -> str:
+        if not (self.scriptInfo and self.stylelist):
+            return super()._formatASS()
+        track = self.track
+        ass = Time.ass
+        events = ''.join(f'{head},{ass(start)},{ass(end)},{style},{middle},{text}\n'
+                         for head, start, end, style, middle, text in zip(
+                             track.heads, track.starts.tolist(), track.ends.tolist(),
+                             track.styles, track.middles, track.texts))
+        events = f'[Events]\n{self.eventFormat}\n{events}'
+        # Attachments are copied from the source file as they are, line by line
+        for name in self.sections.names():
+            if name in ASSSectionScanner.attachments and name not in self.copies:
+                self.copies[name] = self.sections.copy(name)
+            elif name != '[Events]' and name not in self.copies:
+                self.copies[name] = self.sections.read(name).rstrip('\n') + '\n\n'
+        events = f'{events}\n'
+        sections = [events if name == '[Events]' else self.copies[name] for name in self.sections.names()]
+        if '[Events]' not in self.sections.names():
+            sections.append(events)
+        return ''.join(sections).rstrip('\n') + '\n'
+
+class ASSSectionScanner:
+    '''Record the byte offsets of the sections of an ASS file through a memory map.
+
+    Only the sections asked for are decoded, embedded attachments such as
+    [Fonts] and [Graphics] are not read into memory unless the file is written again.
+    '''
+    attachments = ('[Fonts]', '[Graphics]')
+    # Uuencoded attachments may hold lines like [XYZ012], hence a header has to be a
+    # plain name on a line of its own, at the start of the file or after a blank line
+    header = re.compile(rb'\[[A-Za-z0-9+ ]+\]')
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        # Section name -> (start, end) of its body, in bytes
+        self.offsets: dict[str, tuple[int, int]] = {}
+        self.scan()
+
+    def scan(self) -> None:
+        with open(self.path, 'rb') as fp:
+            # mmap refuses to map an empty file
+            if not fp.seek(0, 2):
+                return
+            with mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+                size = len(mm)
+                headers = []
+                # The first header may follow a BOM
+                pos = mm.find(b'[', 0, 4)
+                if pos == -1:
+                    pos = mm.find(b'\n[')
+                while pos != -1:
+                    if mm[pos] == ord('\n'):
+                        pos += 1
+                    eol = mm.find(b'\n', pos)
+                    if eol == -1:
+                        eol = size
+                    name = mm[pos:eol].strip()
+                    blank = pos <= 3 or mm[pos-3:pos].endswith((b'\n\n', b'\n\r\n'))
+                    if blank and self.header.fullmatch(name):
+                        headers.append((name.decode('ascii'), pos, eol))
+                    pos = mm.find(b'\n[', eol)
+        # Each body runs from the end of its header line to the start of the next header
+        ends = [pos for _, pos, _ in headers[1:]] + [size]
+        for (name, _, start), end in zip(headers, ends):
+            self.offsets.setdefault(name, (start, end))
+
+    def names(self) -> list[str]:
+        '''Names of the sections in order of the file'''
+        return list(self.offsets)
+
+    def body(self, name: str) -> str:
+        if (offset := self.offsets.get(name)) is None:
+            return ''
+        start, end = offset
+        with open(self.path, 'rb') as fp:
+            fp.seek(start)
+            return fp.read(end - start).decode('utf-8').replace('\r\n', '\n')
+
+    def read(self, name: str) -> str:
+        '''Decode a section, including its header line, with line endings normalized'''
+        if name not in self.offsets:
+            return ''
+        text = self.body(name).strip('\n')
+        return f'{name}\n{text}'
+
+    def copy(self, name: str) -> str:
+        '''A section exactly as in the file, up to the next header, only line endings normalized'''
+        if name not in self.offsets:
+            return ''
+        return f'{name}{self.body(name)}'
+
 
 class SRTReader(Subtitle):
     timestamp = re.compile(r'(\d{2}:\d{2}:\d{2},\d{3}) --> (\d{2}:\d{2}:\d{2},\d{3})\n(.+?)\n\n', flags = re.DOTALL)
@@ -123,6 +489,7 @@ class SRTReader(Subtitle):
             text = SRTReader.tackleMultilines(text)
             self.append(Timeline(start, end, text))
 
+    @traced('SRTReader.remove_repetitive_lines')
     def remove_repetitive_lines(self) -> None:
         repetition = Counter(line.text for line in self)
         self.sort(key = lambda line: (repetition[line.text], line.text, line.start))
@@ -134,6 +501,16 @@ class SRTReader(Subtitle):
         self.contents += mergedLines
         self.sort()
 
+    def remove_near_duplicates(self, threshold: float = 0.8, gap: int = 0,
+                               strategy: MergeStrategy = MergeStrategy.UNION_SPAN) -> list[ClusterStats]:
+        '''Merge overlapping cues with nearly the same text, such as rolling auto-generated captions.
+
+        Returns the stats of each merged cluster for tuning the threshold.
+        '''
+        index = NearDuplicateIndex(self.contents, threshold = threshold, gap = gap)
+        self.contents = index.merge(strategy)
+        return index.stats()
+
     @staticmethod
     def merge_lines(lines: list[Timeline]) -> list[Timeline]:
         isContinuous = lambda x, y: x.end == y.start
@@ -1,7 +1,8 @@
 import re
+import sys
 from pathlib import Path
-from collections.abc import Sequence
-import openpyxl
+from collections.abc import Sequence, Iterable, Iterator
+from tracing import traced
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
@@ -13,6 +14,7 @@ class TextProcessor:
         self.text = TextProcessor.process(self.raw_text)
 
     @staticmethod
+    @traced('TextProcessor.process')
     def process(text) -> str:
         with open('patterns.csv', 'r', encoding = 'utf-8-sig') as entries:
             for entry in entries:
@@ -27,20 +29,58 @@ class TextProcessor:
 
 
 class BilingualText(Sequence):
-    def __init__(self) -> None:
-        self.contents: list[list[str, str]] = []
+    def __init__(self, intern: bool = False) -> None:
+        # Two parallel columns instead of a list object per row
+        self.jp: list[str] = []
+        self.cn: list[str] = []
+        # Share a single copy of repeated lines, such as interjections
+        self.intern = intern
         
     def __len__(self) -> int:
-        return len(self.contents)
+        return len(self.jp)
     
     def __getitem__(self, idx):
-        return self.contents[idx]
+        if isinstance(idx, slice):
+            return list(zip(self.jp[idx], self.cn[idx]))
+        return self.jp[idx], self.cn[idx]
+
+    def __iter__(self) -> Iterator[tuple[str, str]]:
+        return zip(self.jp, self.cn)
+
+    def append(self, jp: str, cn: str) -> None:
+        if self.intern:
+            jp = sys.intern(jp) if isinstance(jp, str) else jp
+            cn = sys.intern(cn) if isinstance(cn, str) else cn
+        self.jp.append(jp)
+        self.cn.append(cn)
+
+    @staticmethod
+    def iter_txt(lines: Iterable[str]) -> Iterator[tuple[str, str]]:
+        '''Yield JP and CN of each paragraph, a CN line followed by JP lines, one block at a time.
+
+        This reverses _writeTXT: the first two lines of a block are always its CN and JP,
+        even if blank, as rows left untranslated or without JP are written with an empty
+        line, then further JP lines follow until a blank line ends the block.
+        '''
+        block = []
+        for line in lines:
+            line = line.rstrip('\n')
+            if len(block) < 2 or line:
+                block.append(line)
+            else:
+                cn, *jp = block
+                yield '\n'.join(jp), cn
+                block = []
+        # Blank lines at the end of the file are not a row
+        if any(block):
+            cn, *jp = block
+            yield '\n'.join(jp), cn
     
-    def _readTxt(self, text: str) -> None:
-        # Reverse to get jp ahead
-        self.contents = [list(reversed(line.split('\n', maxsplit = 1)))
-                         for line in text.strip().split('\n\n')]
+    def _readTxt(self, lines: Iterable[str]) -> None:
+        for jp, cn in BilingualText.iter_txt(lines):
+            self.append(jp, cn)
     
+    @traced('BilingualText.load_from_ass')
     def load_from_ass(self, source: 'ASSReader'):
         if not source.bilingual:
             raise TypeError('Only bilingual ASS can be loaded.')
@@ -58,13 +98,28 @@ class BilingualText(Sequence):
             jp = re.sub(r'\{.+?\}', r'', jp)
             cn = cnDict.get(key, '')
             cn = re.sub(r'\{.+?\}', r'', cn)
-            self.contents.append([jp, cn])
+            self.append(jp, cn)
+
+    @classmethod
+    def from_path(cls, path: Path, intern: bool = False) -> 'BilingualText':
+        '''Load from a bilingual ASS, TXT or XLSX file, styles of ASS are picked by CN and JP in their names'''
+        text = cls(intern)
+        if path.suffix == '.ass':
+            from subtitle import Subtitle
+            source = Subtitle(path)
+            source.pick([style for style in source.styles
+                         if 'jp' in style.lower() or 'cn' in style.lower()])
+            text.load_from_ass(source)
+        else:
+            text.load_from_file(path)
+        return text
 
+    @traced('BilingualText.load_from_file')
     def load_from_file(self, path: Path):
         match path.suffix:
             case '.txt':
                 with open(path, 'r', encoding = 'utf-8') as fp:
-                    self._readTxt(fp.read())
+                    self._readTxt(fp)
             case '.xlsx':
                 self._readExcel(path)
             case _:
@@ -78,6 +133,8 @@ class BilingualText(Sequence):
             case _: raise ValueError('Unsupported format.')
     
     def _readExcel(self, path):
+        # openpyxl is slow to import, so only imported when a workbook is touched
+        import openpyxl
         excel = openpyxl.load_workbook(path)
         sheet = excel.active
         for line in sheet:
@@ -95,16 +152,15 @@ class BilingualText(Sequence):
                     c = [jp ,'#']
                 case jp, cn:
                     c = [jp, cn]
-            self.contents.append(c)
+            self.append(*c)
 
+    @traced('BilingualText._writeTXT')
     def _writeTXT(self):
         with open(self.outputPath, 'w', encoding = 'utf-8') as fp:
-            for jp, cn in self:
-                fp.write(f'{cn}\n{jp}\n\n')
+            fp.writelines(f'{cn}\n{jp}\n\n' for jp, cn in self)
     
-    def _writeExcel(self):
-        workbook = openpyxl.Workbook()
-        sheet = workbook.active
+    def excel_rows(self):
+        '''Rows of JP, CN and comment, as written into a worksheet'''
         for jp, cn in self:
             try:
                 cn, comment = cn.split('\\')
@@ -112,6 +168,14 @@ class BilingualText(Sequence):
                 comment = None
             if cn == '#':
                 cn = None
-            sheet.append([jp, cn, comment])
-            workbook.save(self.outputPath)
+            yield [jp, cn, comment]
+
+    @traced('BilingualText._writeExcel')
+    def _writeExcel(self):
+        import openpyxl
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        for row in self.excel_rows():
+            sheet.append(row)
+        workbook.save(self.outputPath)
             
@@ -43,6 +43,15 @@ class Timeline:
     def text(self):
         return self._text
     
+    @classmethod
+    def from_ms(cls, start: int, end: int, text: str) -> Timeline:
+        '''Construct from milliseconds directly, without parsing timestamps'''
+        line = cls.__new__(cls)
+        line._start = Time.from_ms(start)
+        line._end = Time.from_ms(end)
+        line._text = text
+        return line
+
     def merge(self, other: Timeline) -> Timeline:
         return Timeline(self.start, other.end, self.text)
     
@@ -61,15 +70,7 @@ class Time:
         return f'<{self.__class__.__name__}: {self!s}>'
     
     def __str__(self) -> str:
-        t = self.time
-        # millisecond, second, minute, hour
-        units = [1000, 60, 60, 24]
-        time = []
-        # Reconstruct from millisecond
-        for u in units:
-            time.append(t % u)
-            t //= u
-        return f'{time[3]:02d}:{time[2]:02d}:{time[1]:02d}.{time[0]:03d}'
+        return self.to_vtt()
     
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, Time):
@@ -85,6 +86,51 @@ class Time:
     @property
     def time(self):
         return self._time
+
+    @classmethod
+    def from_ms(cls, time: int) -> Time:
+        t = cls.__new__(cls)
+        t._time = time
+        return t
+
+    def fields(self) -> tuple[int, int, int, int]:
+        '''Reconstruct hour, minute, second and millisecond'''
+        return Time.split(self.time)
+
+    def to_srt(self) -> str:
+        return Time.srt(self.time)
+
+    def to_vtt(self) -> str:
+        return Time.vtt(self.time)
+
+    def to_ass(self) -> str:
+        return Time.ass(self.time)
+
+    # The formatters below take a time in millisecond, so that writers need no Time objects.
+    # Digits are looked up instead of formatted, which is several times faster for long files
+
+    @staticmethod
+    def split(time: int) -> tuple[int, int, int, int]:
+        second, millisecond = divmod(time, 1000)
+        minute, second = divmod(second, 60)
+        hour, minute = divmod(minute, 60)
+        return hour, minute, second, millisecond
+
+    @staticmethod
+    def srt(time: int) -> str:
+        h, m, s, ms = Time.split(time)
+        return f'{_PADDED2[h] if h < 100 else h}:{_PADDED2[m]}:{_PADDED2[s]},{_PADDED3[ms]}'
+
+    @staticmethod
+    def vtt(time: int) -> str:
+        h, m, s, ms = Time.split(time)
+        return f'{_PADDED2[h] if h < 100 else h}:{_PADDED2[m]}:{_PADDED2[s]}.{_PADDED3[ms]}'
+
+    @staticmethod
+    def ass(time: int) -> str:
+        # ASS keeps only centiseconds, and hours in a single digit
+        h, m, s, ms = Time.split(time)
+        return f'{h}:{_PADDED2[m]}:{_PADDED2[s]}.{_PADDED2[ms // 10]}'
     
     @staticmethod
     def parse(timeStamp: str) -> int:
@@ -97,3 +143,6 @@ class Time:
         units = [3_600_000, 60_000, 1_000, 1]
         return sum(map(operator.mul, map(int, time), units))
 
+
+_PADDED2 = [f'{n:02d}' for n in range(100)]
+_PADDED3 = [f'{n:03d}' for n in range(1000)]
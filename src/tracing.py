@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import threading
+import functools
+import tracemalloc
+from pathlib import Path
+from typing import NamedTuple
+from contextlib import nullcontext
+from collections import defaultdict
+
+
+class Record(NamedTuple):
+    name: str
+    # Start since the tracer was created, and wall time, both in microsecond
+    start: float
+    wall: float
+    # CPU time of the process in microsecond
+    cpu: float
+    # Peak of traced memory above that at the start in bytes, None if memory is not traced
+    peak: int | None
+    thread: int
+
+
+class Span:
+    '''Measure the stage enclosed in a with statement'''
+    def __init__(self, tracer: 'Tracer', name: str) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.peak = 0
+
+    def __enter__(self) -> 'Span':
+        if self.tracer.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            stack = self.tracer.stack()
+            # The peak is shared by nested spans, hand it to the outer one before resetting
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            self.base = current
+            stack.append(self)
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *args) -> None:
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        peak = None
+        if self.tracer.memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            stack = self.tracer.stack()
+            stack.pop()
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+            peak = max(self.peak - self.base, 0)
+        self.tracer.records.append(Record(
+            self.name, (self.wall - self.tracer.origin) * 1e6, wall * 1e6, cpu * 1e6,
+            peak, threading.get_ident()
+        ))
+
+
+class Tracer:
+    def __init__(self) -> None:
+        self.enabled = False
+        self.memory = False
+        self.records: list[Record] = []
+        self.origin = time.perf_counter()
+        self._local = threading.local()
+        self._null = nullcontext()
+
+    def configure(self, enabled: bool, memory: bool = False) -> None:
+        self.enabled = enabled or memory
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stack(self) -> list[Span]:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def span(self, name: str):
+        # A shared no-op context when disabled, so that instrumented code costs almost nothing
+        if not self.enabled:
+            return self._null
+        return Span(self, name)
+
+    def mark(self) -> int:
+        '''Position in the records, for a summary of what happens after it'''
+        return len(self.records)
+
+    def summary(self, since: int = 0) -> list[tuple[str, float, float, int | None]]:
+        '''Name, wall and CPU time in millisecond and peak memory in bytes, summed by stage'''
+        stages = defaultdict(lambda: [0.0, 0.0, None])
+        for record in self.records[since:]:
+            stage = stages[record.name]
+            stage[0] += record.wall / 1000
+            stage[1] += record.cpu / 1000
+            if record.peak is not None:
+                stage[2] = max(stage[2] or 0, record.peak)
+        return [(name, *stage) for name, stage in stages.items()]
+
+    def export(self, path: Path) -> None:
+        '''Write the records as Chrome trace events, which chrome://tracing and Perfetto open'''
+        pid = os.getpid()
+        events = []
+        for record in self.records:
+            args = {'cpu_ms': round(record.cpu / 1000, 3)}
+            if record.peak is not None:
+                args['peak_kb'] = round(record.peak / 1024, 1)
+            events.append({
+                'name': record.name, 'cat': 'pipeline', 'ph': 'X',
+                'ts': record.start, 'dur': record.wall,
+                'pid': pid, 'tid': record.thread, 'args': args
+            })
+        with open(path, 'w', encoding = 'utf-8') as fp:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp, ensure_ascii = False)
+
+
+def traced(name: str):
+    '''Decorator measuring every call of a function as a span'''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with Span(tracer, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def format_summary(summary, separator: str = '\n') -> str:
+    '''One entry per stage, as shown in the GUI'''
+    lines = []
+    for name, wall, cpu, peak in summary:
+        line = f'{name}: {wall:.1f} ms (CPU {cpu:.1f} ms)'
+        if peak is not None:
+            line += f', peak {peak / 1024:.0f} KiB'
+        lines.append(line)
+    return separator.join(lines)
+
+
+# The tracer shared by the whole program, switched on by environment variables or main.py
+tracer = Tracer()
+tracer.configure(os.environ.get('KITAUJI_TRACE', '') not in ('', '0'),
+                 os.environ.get('KITAUJI_TRACE_MEMORY', '') not in ('', '0'))
+span = tracer.span
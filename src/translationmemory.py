@@ -0,0 +1,185 @@
+import re
+import sqlite3
+import argparse
+from pathlib import Path
+from collections import Counter
+from typing import NamedTuple
+
+from textprocessor import BilingualText
+
+
+class Suggestion(NamedTuple):
+    jp: str
+    cn: str
+    episode: str
+    score: float
+
+
+class TranslationMemory:
+    '''JP -> CN pairs of previous episodes, stored in SQLite with an FTS5 index of JP bigrams'''
+    schema = '''
+        CREATE TABLE IF NOT EXISTS pairs (
+            id INTEGER PRIMARY KEY,
+            episode TEXT NOT NULL,
+            jp TEXT NOT NULL,
+            cn TEXT NOT NULL,
+            key TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS pairs_key ON pairs(key);
+        CREATE INDEX IF NOT EXISTS pairs_episode ON pairs(episode);
+        CREATE VIRTUAL TABLE IF NOT EXISTS pairs_grams USING fts5(grams, tokenize = 'unicode61');
+        CREATE VIRTUAL TABLE IF NOT EXISTS pairs_vocab USING fts5vocab(pairs_grams, 'row');
+    '''
+    batchSize = 5000
+    # Bigrams in more lines than this, e.g. した, hardly tell lines apart and are skipped in fuzzy lookups
+    commonGram = 20000
+    comment = re.compile(r'\\(?![Nnh])')
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript(self.schema)
+        self.connection.create_function('ngrams', 1, TranslationMemory.ngrams, deterministic = True)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> 'TranslationMemory':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        # Tags, line breaks, punctuation and spaces do not distinguish two lines
+        text = re.sub(r'\{.*?\}|\\[Nnh]', '', text)
+        return re.sub(r'\W', '', text).lower()
+
+    @staticmethod
+    def ngrams(key: str) -> str:
+        '''Space separated bigrams, which the unicode61 tokenizer sees as separate tokens'''
+        if len(key) < 2:
+            return key
+        return ' '.join(key[i:i+2] for i in range(len(key) - 1))
+
+    def ingest(self, text: BilingualText, episode: str) -> int:
+        '''Replace the pairs of an episode by those in text, return the number of pairs stored'''
+        rows = []
+        for jp, cn in text:
+            # Drop the comment after a backslash, which is not one of the line breaks \N, \n and \h,
+            # and lines left untranslated
+            cn = TranslationMemory.comment.split(cn or '', maxsplit = 1)[0].strip()
+            if not jp or cn in ('', '#'):
+                continue
+            if key := TranslationMemory.normalize(jp):
+                rows.append((episode, jp, cn, key))
+
+        with self.connection:
+            self.connection.execute(
+                'DELETE FROM pairs_grams WHERE rowid IN (SELECT id FROM pairs WHERE episode = ?)', (episode,))
+            self.connection.execute('DELETE FROM pairs WHERE episode = ?', (episode,))
+            (lastID,) = self.connection.execute('SELECT COALESCE(MAX(id), 0) FROM pairs').fetchone()
+            for i in range(0, len(rows), self.batchSize):
+                self.connection.executemany(
+                    'INSERT INTO pairs (episode, jp, cn, key) VALUES (?, ?, ?, ?)',
+                    rows[i:i+self.batchSize])
+            # Index the new rows in one statement
+            self.connection.execute(
+                'INSERT INTO pairs_grams (rowid, grams) SELECT id, ngrams(key) FROM pairs WHERE id > ?', (lastID,))
+        return len(rows)
+
+    def ingest_file(self, path: Path) -> int:
+        return self.ingest(BilingualText.from_path(path), path.stem)
+
+    def lookup(self, jp: str, limit: int = 3, threshold: float = 0.5,
+               exclude: str | None = None) -> list[Suggestion]:
+        '''Previous CN renderings of jp, exact matches first, then similar lines by bigram overlap'''
+        if not (key := TranslationMemory.normalize(jp)):
+            return []
+        exact = self.connection.execute(
+            'SELECT jp, cn, episode FROM pairs WHERE key = ? AND episode IS NOT ? ORDER BY id DESC',
+            (key, exclude)).fetchall()
+        suggestions = [Suggestion(*row, 1.0) for row in exact]
+
+        if len(suggestions) < limit:
+            grams = set(TranslationMemory.ngrams(key).split())
+            # Count the shared bigrams of each line through the posting lists of the rare bigrams,
+            # which avoids ranking every line that shares a single bigram
+            overlaps = Counter()
+            for gram in self.rare_grams(grams):
+                overlaps.update(rowid for (rowid,) in self.connection.execute(
+                    'SELECT rowid FROM pairs_grams WHERE pairs_grams MATCH ?',
+                    ('"{}"'.format(gram.replace('"', '""')),)))
+            # Dice coefficient of at least threshold needs this many shared bigrams
+            minimum = threshold * len(grams) / 2
+            ids = [rowid for rowid, count in overlaps.most_common(limit * 20) if count >= minimum]
+            candidates = self.connection.execute(
+                f'SELECT jp, cn, episode, key FROM pairs WHERE id IN ({",".join("?" * len(ids))}) '
+                'AND key != ? AND episode IS NOT ?',
+                (*ids, key, exclude)).fetchall()
+            for candidate, cn, episode, candidateKey in candidates:
+                other = set(TranslationMemory.ngrams(candidateKey).split())
+                score = 2 * len(grams & other) / (len(grams) + len(other))
+                if score >= threshold:
+                    suggestions.append(Suggestion(candidate, cn, episode, score))
+            suggestions.sort(key = lambda s: s.score, reverse = True)
+
+        # The same rendering from several episodes is shown only once
+        unique = {}
+        for suggestion in suggestions:
+            unique.setdefault(suggestion.cn, suggestion)
+        return list(unique.values())[:limit]
+
+    def rare_grams(self, grams: set[str]) -> list[str]:
+        counts = dict(self.connection.execute(
+            f'SELECT term, doc FROM pairs_vocab WHERE term IN ({",".join("?" * len(grams))})',
+            tuple(grams)).fetchall())
+        present = sorted((counts[gram], gram) for gram in grams if gram in counts)
+        # Keep at least the rarest one, even if every bigram is common
+        return [gram for count, gram in present[:1] + [g for g in present[1:] if g[0] <= self.commonGram]]
+
+    def suggest(self, jp: str, exclude: str | None = None) -> str:
+        '''The best CN rendering of jp, or an empty string'''
+        if suggestions := self.lookup(jp, limit = 1, exclude = exclude):
+            return suggestions[0].cn
+        return ''
+
+
+def open_memory(path: Path | None = None) -> TranslationMemory | None:
+    '''Open the memory at path, or the one set by translation_memory in config.json'''
+    if path is None:
+        from config import read_config
+        try:
+            path = read_config().get('translation_memory')
+        except FileNotFoundError:
+            path = None
+    return TranslationMemory(Path(path)) if path else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description = '翻译记忆库')
+    parser.add_argument('--db', type = Path, help = '记忆库文件路径，默认为config.json中的translation_memory')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+    ingest = commands.add_parser('ingest', help = '导入双语ASS、TXT或XLSX文件')
+    ingest.add_argument('files', type = Path, nargs = '+')
+    query = commands.add_parser('query', help = '查询日文句子的既有译文')
+    query.add_argument('text')
+    query.add_argument('--limit', type = int, default = 5)
+    query.add_argument('--threshold', type = float, default = 0.5)
+    args = parser.parse_args()
+
+    if (memory := open_memory(args.db)) is None:
+        parser.error('未指定记忆库文件路径')
+    with memory:
+        match args.command:
+            case 'ingest':
+                for path in args.files:
+                    print(f'{path.name}: {memory.ingest_file(path)}')
+            case 'query':
+                for suggestion in memory.lookup(args.text, args.limit, args.threshold):
+                    print(f'{suggestion.score:.2f}\t{suggestion.cn}\t{suggestion.jp}\t[{suggestion.episode}]')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import re
+import argparse
+import itertools
+from pathlib import Path
+from collections import deque
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+
+from textprocessor import BilingualText
+from tracing import span
+from resultcache import result_cache
+
+
+def load_episode(path: Path, useCache: bool = True) -> tuple[BilingualText, bool]:
+    '''Parse and align one bilingual ASS or TXT file, run in a worker process.
+
+    Returns whether it was a cache hit as well, as counters of workers are not shared.
+    '''
+    cache = result_cache()
+    cache.enabled = useCache
+    # Styles are picked by name in from_path, hence not part of the key
+    key = cache.key(path, [], 'bilingual')
+    if (text := cache.get(key)) is not None:
+        return text, True
+    text = BilingualText.from_path(path)
+    cache.put(key, text)
+    return text, False
+
+
+def sheet_title(path: Path, used: set[str]) -> str:
+    # Excel forbids []:*?/\ in titles and allows at most 31 characters, titles must be unique
+    base = re.sub(r'[\[\]:*?/\\]', '_', path.stem)[:31] or 'Sheet'
+    title = base
+    for n in itertools.count(2):
+        if title.lower() not in used:
+            break
+        suffix = f' ({n})'
+        title = base[:31 - len(suffix)] + suffix
+    used.add(title.lower())
+    return title
+
+
+def build_workbook(paths: Iterable[Path], output: Path, workers: int = 4, useCache: bool = True) -> int:
+    '''Write the episodes into one workbook, a sheet per episode in the order given.
+
+    Episodes are parsed concurrently in worker processes, while the workbook is
+    written in write-only mode, which streams each sheet to disk. The next episode is
+    submitted once the current one is written and released, so this process holds at
+    most `workers` parsed episodes, the one being written and the results of those in
+    flight, and memory grows with the number of workers rather than the length of the season.
+    Returns the number of sheets written.
+    '''
+    import openpyxl
+    workbook = openpyxl.Workbook(write_only = True)
+    used = set()
+    sheets = 0
+    paths = iter(paths)
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque((path, pool.submit(load_episode, path, useCache))
+                        for path in itertools.islice(paths, workers))
+        while pending:
+            path, future = pending.popleft()
+            text, hit = future.result()
+            result_cache().count(hit)
+            with span('workbook.write_episode'):
+                sheet = workbook.create_sheet(sheet_title(path, used))
+                for row in text.excel_rows():
+                    sheet.append(row)
+            # Released before the next job is submitted, as its result will be held here as well
+            del text, future
+            sheets += 1
+            if (nextPath := next(paths, None)) is not None:
+                pending.append((nextPath, pool.submit(load_episode, nextPath, useCache)))
+    with span('workbook.save'):
+        workbook.save(output)
+    return sheets
+
+
+def main():
+    parser = argparse.ArgumentParser(description = '将多集双语ASS或TXT文件合并为一个XLSX工作簿，每集一个工作表')
+    parser.add_argument('files', type = Path, nargs = '+')
+    parser.add_argument('-o', '--output', type = Path, required = True, help = '输出的XLSX文件路径')
+    parser.add_argument('-j', '--workers', type = int, default = 4, help = '并行解析的进程数')
+    parser.add_argument('--no-cache', action = 'store_true', help = '不使用也不写入结果缓存')
+    args = parser.parse_args()
+    result_cache().enabled = not args.no_cache
+    sheets = build_workbook(args.files, args.output, args.workers, not args.no_cache)
+    print(f'{args.output}: {sheets}')
+    print(result_cache().stats())
+
+
+if __name__ == '__main__':
+    main()